@@ -4,43 +4,102 @@ and distances) for celestial bodies from NASA's JPL Horizons API.
 """
 
 
+import bisect
+import functools
+import math
+import os
+import re
+import time
+from types import MappingProxyType
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import serial
-import numpy as np
 from PlaneraryObjectSelection import PlanetaryObjectSelection
 
+try:
+    import orjson as json  # Faster decoding of the Horizons response, if installed
+except ImportError:
+    import json
+
 serial = serial.Serial(
         port='COM6',  
         baudrate=9600,
-        timeout=1
+        timeout=1  # readline() sleeps up to 1 s per call, so no busy-polling and Ctrl+C still works
     )
 
+# Shared HTTP session so repeated Horizons queries reuse the same keep-alive connection
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# First data row after the ($)$SOE marker; a row cannot start with "$", so an
+# empty ephemeris ($SOE immediately followed by $EOE) does not match
+_FIRST_DATA_ROW = re.compile(r"\$SOE[^\n]*\n\s*([^$\s][^\n]*)")
+
+# (timestamp, (lat, lon, elev)) of the last successful geolocation lookup
+_user_location_cache = None
+
 class PlanetaryObjectsFetcher:
     """
     A utility class for fetching astronomical ephemeris data from NASA's JPL Horizons system.
     
     This class provides methods to retrieve coordinates and distances for various celestial
     bodies such as planets, moons, asteroids, and comets. Coordinates are computed based on
-    the user's geographic location (via IP geolocation).
+    the observer's geographic location: a fixed site from SITE_COORD_STR or site.json
+    when configured, otherwise IP geolocation (see get_site_coord).
     
     Attributes:
         BASE_REQUEST_URL (str): The base URL for the JPL Horizons API endpoint.
+        REQUEST_TIMEOUT (float): Seconds to wait on any HTTP request before giving up.
+        LOCATION_TTL (float): Seconds a geolocation lookup is reused before refreshing.
+        SITE_CONFIG_PATH (str): Optional JSON file with the observer's fixed location.
+        SITE_COORD_STR (str): Horizons SITE_COORD override. When set (directly or from
+                              SITE_CONFIG_PATH), IP geolocation is skipped entirely.
+        LOCAL_MOON (bool): Compute the Moon's position locally with a low-precision
+                           lunar theory (within ~0.3 degrees) instead of Horizons.
+                           Set to False when full Horizons precision is needed.
     """
     BASE_REQUEST_URL = "https://ssd.jpl.nasa.gov/api/horizons.api"
+    REQUEST_TIMEOUT = 10
+    LOCATION_TTL = 3600
+    SITE_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "site.json")
+    SITE_COORD_STR = None
+    LOCAL_MOON = True
+
+    # Query parameters shared by every request; per-request fields are merged in
+    _BASE_PARAMS = MappingProxyType({
+        "format": "json",
+        "CENTER": "coord@399",  # Coordinate-based observer on Earth
+        "COORD_TYPE": "GEODETIC",
+        "MAKE_EPHEM": "YES",
+        "EPHEM_TYPE": "OBSERVER",
+        "OUT_UNITS": "KM-S",
+        "CSV_FORMAT": "YES"  # Compact comma-delimited rows with a stable column order
+    })
 
 
     @staticmethod
     def get_user_location():
         """
         Get approximate user location using ipinfo.io.
+
+        A successful lookup is reused for LOCATION_TTL seconds.
         
         Returns:
             tuple: A tuple containing (latitude, longitude, elevation_meters).
                   Returns (0, 0, 0) if location lookup fails.
         """
+        global _user_location_cache
+        if _user_location_cache is not None:
+            timestamp, location = _user_location_cache
+            if time.time() - timestamp < PlanetaryObjectsFetcher.LOCATION_TTL:
+                return location
+
         try:
-            data = requests.get("https://ipinfo.io/json").json()
+            data = _session.get(
+                "https://ipinfo.io/json", timeout=PlanetaryObjectsFetcher.REQUEST_TIMEOUT
+            ).json()
 
             loc = data.get("loc", "0,0")  # "lat,lon"
             lat_str, lon_str = loc.split(",")
@@ -49,6 +108,7 @@ class PlanetaryObjectsFetcher:
             lon = float(lon_str)
             elev = 0  # no elevation data available iva ipinfo
 
+            _user_location_cache = (time.time(), (lat, lon, elev))
             return lat, lon, elev
         except Exception as e:
             print("Location lookup failed:", e)
@@ -79,14 +139,92 @@ class PlanetaryObjectsFetcher:
         return tomorrow.strftime("%Y-%m-%d")
     
 
+    @staticmethod
+    def get_site_coord():
+        """
+        Build the Horizons SITE_COORD string for the user's geographic location.
+
+        The fixed location from SITE_COORD_STR or SITE_CONFIG_PATH is preferred, since
+        the tracker does not move during a session; IP geolocation is only used as a
+        fallback when neither is available.
+
+        Returns:
+            str: Quoted 'E-lon,lat,elev_km' string as expected by the Horizons API.
+        """
+        site_coord = PlanetaryObjectsFetcher.SITE_COORD_STR or PlanetaryObjectsFetcher.load_site_coord()
+        if site_coord:
+            return site_coord
+
+        # Get real user geolocation
+        lat, lon, elev = PlanetaryObjectsFetcher.get_user_location()
+        return PlanetaryObjectsFetcher.format_site_coord(lat, lon, elev)
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def load_site_coord(path=None):
+        """
+        Load the observer's fixed location from a JSON config file, once per session.
+
+        The file holds latitude and longitude in degrees and an optional elevation
+        in meters, e.g. {"latitude": 34.05, "longitude": -118.25, "elevation_m": 89}.
+
+        Args:
+            path (str): Config file to read. Defaults to SITE_CONFIG_PATH.
+
+        Returns:
+            str: SITE_COORD string for the configured location, or None if the file
+                 does not exist or cannot be parsed.
+        """
+        path = path or PlanetaryObjectsFetcher.SITE_CONFIG_PATH
+        try:
+            with open(path, "rb") as config_file:
+                site = json.loads(config_file.read())
+
+            lat = float(site["latitude"])
+            lon = float(site["longitude"])
+            elev = float(site.get("elevation_m", 0))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print("Site config invalid:", e)
+            return None
+
+        return PlanetaryObjectsFetcher.format_site_coord(lat, lon, elev)
+
+
+    @staticmethod
+    def format_site_coord(lat, lon, elev):
+        """
+        Format a geographic location as a Horizons SITE_COORD string.
+
+        Args:
+            lat (float): Latitude in degrees.
+            lon (float): Longitude in degrees, East positive (-180 to 360).
+            elev (float): Elevation in meters.
+
+        Returns:
+            str: Quoted 'E-lon,lat,elev_km' string as expected by the Horizons API.
+        """
+        elev_km = elev / 1000.0
+
+        # Convert longitude to East longitude (0-360) if negative
+        if lon < 0:
+            lon = lon + 360
+
+        return f"'{lon},{lat},{elev_km}'"
+
+
     @staticmethod 
     def fetch_ephemeris_data(target_body, quantities):
         """
         Fetch ephemeris data for a specified celestial body from JPL Horizons API.
         
-        This method queries the Horizons system for astronomical data over a 24-hour
-        period starting from the current date, with hourly intervals. Data is computed
-        from the user's geographic location obtained via IP geolocation.
+        This method queries the Horizons system for a two-minute window starting at
+        the current UT minute, with one-minute intervals, so only the rows needed for
+        the current position are computed and sent. Data is computed from the observer
+        site returned by get_site_coord(): SITE_COORD_STR or site.json if configured,
+        with IP geolocation as a fallback.
         
         Args:
             target_body (str): The Horizons identifier for the target body.
@@ -99,42 +237,73 @@ class PlanetaryObjectsFetcher:
             list: A list containing the parsed ephemeris data line(s).
                  Returns empty list if the request fails.
         """
-        current_date = PlanetaryObjectsFetcher.get_current_date()
-        tomorrow_date = PlanetaryObjectsFetcher.get_tomorrow_date()
+        # Minute resolution also rounds the cache key to the step size
+        now = datetime.utcnow()
+        start_time = now.strftime("%Y-%m-%d %H:%M")
+        stop_time = (now + timedelta(minutes=2)).strftime("%Y-%m-%d %H:%M")
+        site_coord = PlanetaryObjectsFetcher.get_site_coord()
 
-        # Get real user geolocation
-        lat, lon, elev = PlanetaryObjectsFetcher.get_user_location()
-        elev_km = elev / 1000.0
-        
-        # Convert longitude to East longitude (0-360) if negative
-        if lon < 0:
-            lon = lon + 360
+        try:
+            return PlanetaryObjectsFetcher._cached_fetch(
+                str(target_body), quantities, f"'{start_time}'", f"'{stop_time}'", "1m", site_coord
+            )
+        except requests.HTTPError as e:
+            print(f"Error fetching coordinates: {e.response.status_code}")
+            return []
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _cached_fetch(target_body, quantities, start_time, stop_time, step_size, site_coord):
+        """
+        Fetch and parse a Horizons query, caching the result in memory.
+
+        Every argument is part of the cache key, so a query is only sent to Horizons
+        once per (target, quantities, start, stop, step, observer site).
+
+        Raises:
+            requests.HTTPError: If the Horizons API does not respond with 200. Errors
+                               are raised rather than returned so they are never cached.
+        """
+        ephemeris_text = PlanetaryObjectsFetcher._request_ephemeris(
+            target_body, quantities, start_time, stop_time, step_size, site_coord
+        )
+        return PlanetaryObjectsFetcher.parse_ephemeris_data(ephemeris_text)
+
+
+    @staticmethod
+    def _request_ephemeris(target_body, quantities, start_time, stop_time, step_size, site_coord):
+        """
+        Send a single OBSERVER ephemeris query to the Horizons API.
 
+        Returns:
+            str: The raw ephemeris text from the "result" key of the response.
+
+        Raises:
+            requests.HTTPError: If the Horizons API does not respond with 200.
+        """
         params = {
-            "format": "json",
-            "COMMAND": str(target_body),
-            "CENTER": "coord@399",  # Coordinate-based observer on Earth
-            "COORD_TYPE": "GEODETIC",
-            "SITE_COORD": f"'{lon},{lat},{elev_km}'",
-            "MAKE_EPHEM": "YES",
-            "EPHEM_TYPE": "OBSERVER",
-            "OUT_UNITS": "KM-S",
+            **PlanetaryObjectsFetcher._BASE_PARAMS,
+            "COMMAND": target_body,
+            "SITE_COORD": site_coord,
             "QUANTITIES": quantities,
-            "START_TIME": current_date,
-            "STOP_TIME": tomorrow_date,
-            "STEP_SIZE": "1h"
+            "START_TIME": start_time,
+            "STOP_TIME": stop_time,
+            "STEP_SIZE": step_size
         }
 
-        response = requests.get(PlanetaryObjectsFetcher.BASE_REQUEST_URL, params=params)
+        response = _session.get(
+            PlanetaryObjectsFetcher.BASE_REQUEST_URL,
+            params=params,
+            timeout=PlanetaryObjectsFetcher.REQUEST_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise requests.HTTPError(response=response)
 
-        if response.status_code == 200:
-            data_dict = response.json()  # Converts json into dictionary
-            ephemeris_text = data_dict.get("result")  # Gets the text inside the result key
+        data_dict = json.loads(response.content)  # Converts json into dictionary
+        ephemeris_text = data_dict.get("result")  # Gets the text inside the result key
 
-            return PlanetaryObjectsFetcher.parse_ephemeris_data(ephemeris_text)
-        else:
-            print(f"Error fetching coordinates: {response.status_code}")
-            return []
+        return ephemeris_text
 
 
     @staticmethod
@@ -156,21 +325,57 @@ class PlanetaryObjectsFetcher:
             list: A list containing the first data line as a string.
                  Returns empty list if no data is found between markers.
         """
-        ephemeris_lines = ephemeris_text.split("\n")
-        data_lines = []
-        data_found = False
-        
-        for line in ephemeris_lines:
-            if "$SOE" in line:
-                data_found = True
-                continue
-            if "$EOE" in line:
-                break
-            if data_found and line.strip():
-                data_lines.append(line.strip())
-                break
-        
-        return data_lines
+        match = _FIRST_DATA_ROW.search(ephemeris_text)
+        return [match.group(1).strip()] if match else []
+
+
+    @staticmethod
+    def parse_ephemeris_table(ephemeris_text):
+        """
+        Parse every data line between the $SOE and $EOE markers.
+
+        Unlike parse_ephemeris_data, which keeps only the first row, this is used
+        when a single query covers a whole time window (one row per STEP_SIZE).
+
+        Args:
+            ephemeris_text (str): Raw text response from the Horizons API containing
+                                 ephemeris data with $SOE and $EOE markers.
+
+        Returns:
+            list: All non-empty data lines as strings, in time order.
+        """
+        block = PlanetaryObjectsFetcher._ephemeris_block(ephemeris_text)
+        return [line.strip() for line in block.splitlines() if line.strip()]
+
+
+    @staticmethod
+    def _ephemeris_block(ephemeris_text):
+        """
+        Slice out the text between the $SOE and $EOE markers.
+
+        Uses str.find rather than splitting the whole response into lines, so only
+        the ephemeris block itself is copied.
+
+        Returns:
+            str: The text between the markers, or an empty string if $SOE is missing.
+        """
+        soe = ephemeris_text.find("$SOE")
+        if soe < 0:
+            return ""
+
+        # Data starts on the line after the ($)$SOE marker...
+        start = ephemeris_text.find("\n", soe)
+        if start < 0:
+            return ""
+
+        # ...and ends on the line before the ($)$EOE marker
+        eoe = ephemeris_text.find("$EOE", start)
+        if eoe < 0:
+            end = len(ephemeris_text)
+        else:
+            end = ephemeris_text.rfind("\n", start, eoe)
+
+        return ephemeris_text[start + 1:end]
 
 
     @staticmethod   
@@ -218,20 +423,309 @@ class PlanetaryObjectsFetcher:
         ephemeris coordinate data returned by fetch_coordinates().
 
         Args:
-            coord_string (str): Raw coordinate string from Horizons API.
-                               Example: "2025-Nov-29 00:00 *m  131.587713  38.069515"
+            coord_string (str): Raw CSV coordinate row from Horizons API, with columns
+                               date, solar presence, lunar presence, azimuth, elevation.
+                               Example: "2025-Nov-29 00:00,*,m, 131.587713, 38.069515,"
 
         Returns:
             tuple: A tuple containing (azimuth, elevation) as floats.
                   - azimuth (float): Horizontal angle in degrees (0-360)
                   - elevation (float): Vertical angle in degrees (0-90)
         """
-        parts = coord_string.split()
-        azimuth = float(parts[-2])
-        elevation = float(parts[-1])
+        fields = coord_string.split(",")
+        azimuth = float(fields[3])
+        elevation = float(fields[4])
+        return azimuth, elevation
+
+
+    @staticmethod
+    def fetch_coordinate_table(target_body, start_time, stop_time, step_size, site_coord):
+        """
+        Fetch Azimuth/Elevation rows for a target body over a time window.
+
+        Args:
+            target_body (str): The Horizons identifier for the target body.
+            start_time (str): Window start in UT, e.g. '2025-11-29 00:00'.
+            stop_time (str): Window end in UT.
+            step_size (str): Horizons step size between rows, e.g. '5m'.
+            site_coord (str): Observer site as returned by get_site_coord().
+
+        Returns:
+            tuple: (times, azimuths, elevations) as lists of floats, one entry per row.
+                  times are UT seconds (see _to_seconds) and azimuths are unwrapped
+                  so they can be interpolated across the 0/360 boundary. Plain lists
+                  keep lookups in pure-Python float arithmetic.
+        """
+        ephemeris_text = PlanetaryObjectsFetcher._request_ephemeris(
+            str(target_body), "4", f"'{start_time}'", f"'{stop_time}'", step_size, site_coord
+        )
+
+        rows = PlanetaryObjectsFetcher.parse_ephemeris_table(ephemeris_text)
+        if not rows:
+            return [], [], []
+
+        times, azimuths, elevations = [], [], []
+        for row in rows:
+            row_time = datetime.strptime(row.split(",", 1)[0].strip(), "%Y-%b-%d %H:%M")
+            azimuth, elevation = PlanetaryObjectsFetcher.parse_coordinates(row)
+
+            # Unwrap: step by the short way around so azimuth is continuous across 0/360
+            if azimuths:
+                azimuth = azimuths[-1] + (azimuth - azimuths[-1] + 180) % 360 - 180
+
+            times.append(PlanetaryObjectsFetcher._to_seconds(row_time))
+            azimuths.append(azimuth)
+            elevations.append(elevation)
+
+        return times, azimuths, elevations
+
+
+    @staticmethod
+    def prefetch_all(objects, step="5m", hours=6):
+        """
+        Fetch Azimuth/Elevation tables for many objects concurrently.
+
+        One Horizons query per object is sent in parallel over the shared session,
+        covering the next `hours` hours at `step` resolution. The serial loop can
+        then answer Arduino requests with lookup_coordinates() instead of a
+        network round-trip.
+
+        Args:
+            objects (dict): Mapping of object name to Horizons identifier,
+                           e.g. PlanetaryObjectSelection.OBJECTS.
+            step (str): Horizons step size between rows. Defaults to '5m'.
+            hours (int): Length of the prefetched window in hours. Defaults to 6.
+
+        Returns:
+            dict: {name: (times, azimuths, elevations)} for every object that
+                  was fetched successfully (see fetch_coordinate_table).
+        """
+        start = datetime.utcnow()
+        stop = start + timedelta(hours=hours)
+        start_time = start.strftime("%Y-%m-%d %H:%M")
+        stop_time = stop.strftime("%Y-%m-%d %H:%M")
+        site_coord = PlanetaryObjectsFetcher.get_site_coord()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
+                name: executor.submit(
+                    PlanetaryObjectsFetcher.fetch_coordinate_table,
+                    object_id, start_time, stop_time, step, site_coord
+                )
+                for name, object_id in objects.items()
+            }
+
+        tables = {}
+        for name, future in futures.items():
+            try:
+                tables[name] = future.result()
+            except Exception as e:
+                print(f"Prefetch failed for {name}: {e}")
+        return tables
+
+
+    @staticmethod
+    def lookup_coordinates(table, when=None):
+        """
+        Interpolate Azimuth/Elevation at a given time from a prefetched table.
+
+        Args:
+            table (tuple): (times, azimuths, elevations) lists from fetch_coordinate_table(),
+                          or None if the object has not been prefetched.
+            when (datetime): UT time to look up. Defaults to the current UT time.
+
+        Returns:
+            tuple: (azimuth, elevation) as floats, or None if `when` is outside the table.
+        """
+        if table is None:
+            return None
+
+        times, azimuths, elevations = table
+        t = PlanetaryObjectsFetcher._to_seconds(datetime.utcnow() if when is None else when)
+        if len(times) < 2 or not times[0] <= t <= times[-1]:
+            return None
+
+        # Scalar lookup: bisect + plain float arithmetic on lists, no NumPy scalars
+        i = min(bisect.bisect_right(times, t), len(times) - 1)
+        fraction = (t - times[i - 1]) / (times[i] - times[i - 1])
+        azimuth = (azimuths[i - 1] + fraction * (azimuths[i] - azimuths[i - 1])) % 360
+        elevation = elevations[i - 1] + fraction * (elevations[i] - elevations[i - 1])
         return azimuth, elevation
+
+
+    @staticmethod
+    def _to_seconds(when):
+        """
+        Convert a naive UT datetime to float seconds on the same scale as table times.
+        """
+        return (when - datetime(1970, 1, 1)).total_seconds()
+
+
+    @staticmethod
+    def julian_date(when):
+        """
+        Convert a naive UT datetime to a Julian Date.
+        """
+        return PlanetaryObjectsFetcher._to_seconds(when) / 86400.0 + 2440587.5
+
+
+    @staticmethod
+    def compute_moon_radec_local(jd):
+        """
+        Compute the Moon's geocentric position without a network call.
+
+        Uses the low-precision lunar series from the Astronomical Almanac (a truncated
+        ELP-2000 theory, as in Meeus ch. 47): six periodic terms for longitude, four
+        for latitude and five for horizontal parallax. Compared with airless topocentric
+        positions, the error is at most about 0.3 degrees, which is well within the
+        pointing resolution of the tracker.
+
+        Args:
+            jd (float): Julian Date (UT).
+
+        Returns:
+            tuple: (right_ascension, declination, horizontal_parallax) in degrees.
+        """
+        T = (jd - 2451545.0) / 36525.0
+
+        def sin_d(angle):
+            return math.sin(math.radians(angle))
+
+        def cos_d(angle):
+            return math.cos(math.radians(angle))
+
+        # Ecliptic longitude and latitude (mean equinox of date)
+        longitude = (218.32 + 481267.881 * T
+                     + 6.29 * sin_d(135.0 + 477198.87 * T)
+                     - 1.27 * sin_d(259.3 - 413335.36 * T)
+                     + 0.66 * sin_d(235.7 + 890534.22 * T)
+                     + 0.21 * sin_d(269.9 + 954397.74 * T)
+                     - 0.19 * sin_d(357.5 + 35999.05 * T)
+                     - 0.11 * sin_d(186.5 + 966404.03 * T))
+        latitude = (5.13 * sin_d(93.3 + 483202.02 * T)
+                    + 0.28 * sin_d(228.2 + 960400.89 * T)
+                    - 0.28 * sin_d(318.3 + 6003.15 * T)
+                    - 0.17 * sin_d(217.6 - 407332.21 * T))
+        parallax = (0.9508
+                    + 0.0518 * cos_d(135.0 + 477198.87 * T)
+                    + 0.0095 * cos_d(259.3 - 413335.36 * T)
+                    + 0.0078 * cos_d(235.7 + 890534.22 * T)
+                    + 0.0028 * cos_d(269.9 + 954397.74 * T))
+
+        # Ecliptic -> equatorial direction cosines (obliquity ~23.44 deg)
+        x = cos_d(latitude) * cos_d(longitude)
+        y = 0.9175 * cos_d(latitude) * sin_d(longitude) - 0.3978 * sin_d(latitude)
+        z = 0.3978 * cos_d(latitude) * sin_d(longitude) + 0.9175 * sin_d(latitude)
+
+        right_ascension = math.degrees(math.atan2(y, x)) % 360
+        declination = math.degrees(math.asin(z))
+        return right_ascension, declination, parallax
+
+
+    @staticmethod
+    def compute_moon_coordinates_local(when=None, site_coord=None):
+        """
+        Compute the Moon's topocentric Azimuth/Elevation without a network call.
+
+        Args:
+            when (datetime): UT time. Defaults to the current UT time.
+            site_coord (str): Observer site as returned by get_site_coord().
+                             Defaults to get_site_coord().
+
+        Returns:
+            tuple: (azimuth, elevation) in degrees, on the same conventions as
+                  Horizons quantity 4 (azimuth from North through East, airless).
+        """
+        if when is None:
+            when = datetime.utcnow()
+        if site_coord is None:
+            site_coord = PlanetaryObjectsFetcher.get_site_coord()
+
+        lon, lat, _ = (float(value) for value in site_coord.strip("'").split(","))
+        jd = PlanetaryObjectsFetcher.julian_date(when)
+        right_ascension, declination, parallax = PlanetaryObjectsFetcher.compute_moon_radec_local(jd)
+
+        # Local sidereal time (IAU 1982 GMST plus East longitude) and hour angle
+        T = (jd - 2451545.0) / 36525.0
+        sidereal_time = (280.46061837 + 360.98564736629 * (jd - 2451545.0)
+                         + 0.000387933 * T * T - T * T * T / 38710000.0 + lon)
+        hour_angle = math.radians(sidereal_time - right_ascension)
+
+        lat = math.radians(lat)
+        declination = math.radians(declination)
+
+        elevation = math.asin(math.sin(lat) * math.sin(declination)
+                              + math.cos(lat) * math.cos(declination) * math.cos(hour_angle))
+        azimuth = math.atan2(-math.cos(declination) * math.sin(hour_angle),
+                             math.sin(declination) * math.cos(lat)
+                             - math.cos(declination) * math.sin(lat) * math.cos(hour_angle))
+
+        # Geocentric -> topocentric: the Moon is lowered by up to ~1 deg of parallax
+        elevation -= math.asin(math.sin(math.radians(parallax)) * math.cos(elevation))
+
+        return math.degrees(azimuth) % 360, math.degrees(elevation)
     
 #serial.write(PlanetaryObjectsFetcher.fetch_distance("301")[0])
+
+
+def handle_message(raw_data, ephemeris_tables):
+    """
+    Build the reply to a single line received from the Arduino.
+
+    Kept free of serial I/O so the main loop is just read -> handle -> write.
+
+    Args:
+        raw_data (bytes): One line read from the serial port, e.g. b"STAR:Moon\n".
+        ephemeris_tables (dict): Prefetched tables from prefetch_all(); refreshed in
+                                 place when an object's window has expired.
+
+    Returns:
+        bytes: "<azimuth>,<elevation>\n" reply, or b"" if there is nothing to send.
+    """
+    raw_data = raw_data.decode('utf-8').strip()
+    print(f"Received: {raw_data}")
+
+    # Parse "STAR:ObjectName" format from Arduino
+    if not raw_data.startswith("STAR:"):
+        return b""
+
+    object_name = raw_data[5:]  # Remove "STAR:" prefix
+    if object_name not in PlanetaryObjectSelection.OBJECTS:
+        print(f"✗ Unknown object: {object_name}\n")
+        return b""
+
+    object_id = PlanetaryObjectSelection.OBJECTS[object_name]
+    print(f"Looking up coordinates for {object_name} (ID: {object_id})...")
+
+    try:
+        if object_name == "Moon" and PlanetaryObjectsFetcher.LOCAL_MOON:
+            coordinates = PlanetaryObjectsFetcher.compute_moon_coordinates_local()
+        else:
+            coordinates = PlanetaryObjectsFetcher.lookup_coordinates(
+                ephemeris_tables.get(object_name)
+            )
+
+        if coordinates is None:
+            # Outside the prefetched window: refresh this object only
+            ephemeris_tables.update(
+                PlanetaryObjectsFetcher.prefetch_all({object_name: object_id})
+            )
+            coordinates = PlanetaryObjectsFetcher.lookup_coordinates(
+                ephemeris_tables.get(object_name)
+            )
+    except Exception as e:
+        print(f"✗ Error fetching data: {e}\n")
+        return b""
+
+    if not coordinates:
+        print(f"✗ No data returned for {object_name}\n")
+        return b""
+
+    azimuth, elevation = coordinates
+    print(f"✓ Sending: Az={azimuth:.2f}° El={elevation:.2f}°\n")
+    # bytes %-formatting skips the str build + encode step
+    return b"%.4f,%.4f\n" % (azimuth, elevation)
+
     
 if __name__ == "__main__":
     print("Arduino-Python Celestial Object Tracker")
@@ -239,32 +733,20 @@ if __name__ == "__main__":
     print(f"Serial port: {serial.port}")
     print(f"Baudrate: {serial.baudrate}")
     print("Available objects:", ", ".join(PlanetaryObjectSelection.OBJECTS.keys()))
+    print("\nPrefetching ephemerides...")
+    # The Moon is computed locally when LOCAL_MOON is set, so it needs no Horizons table
+    prefetch_objects = {
+        name: object_id for name, object_id in PlanetaryObjectSelection.OBJECTS.items()
+        if not (name == "Moon" and PlanetaryObjectsFetcher.LOCAL_MOON)
+    }
+    ephemeris_tables = PlanetaryObjectsFetcher.prefetch_all(prefetch_objects)
     print("\nWaiting for Arduino commands...\n")
 
     while True:
-        if serial.in_waiting > 0:
-            raw_data = serial.readline()
-            raw_data = raw_data.decode('utf-8').strip()
-            print(f"Received: {raw_data}")
-
-            # Parse "STAR:ObjectName" format from Arduino
-            if raw_data.startswith("STAR:"):
-                object_name = raw_data[5:]  # Remove "STAR:" prefix
-
-                if object_name in PlanetaryObjectSelection.OBJECTS:
-                    object_id = PlanetaryObjectSelection.OBJECTS[object_name]
-                    print(f"Fetching coordinates for {object_name} (ID: {object_id})...")
-
-                    try:
-                        data = PlanetaryObjectsFetcher.fetch_coordinates(object_id)
-                        if data:
-                            azimuth, elevation = PlanetaryObjectsFetcher.parse_coordinates(data[0])
-                            message = f"{azimuth:.6f},{elevation:.6f}\n"
-                            serial.write(message.encode('utf-8'))
-                            print(f"✓ Sent: Az={azimuth:.2f}° El={elevation:.2f}°\n")
-                        else:
-                            print(f"✗ No data returned for {object_name}\n")
-                    except Exception as e:
-                        print(f"✗ Error fetching data: {e}\n")
-                else:
-                    print(f"✗ Unknown object: {object_name}\n")
\ No newline at end of file
+        raw_data = serial.readline()
+        if not raw_data:
+            continue
+
+        reply = handle_message(raw_data, ephemeris_tables)
+        if reply:
+            serial.write(reply)
\ No newline at end of file